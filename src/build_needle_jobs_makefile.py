@@ -5,9 +5,9 @@ from collections import defaultdict
 import os
 
 TISSUES = {
-    "proteome": "build/pepdb_rts_60min_gradient.csv",
-    "liver": "build/liver_rts_60min_gradient.csv",
-    "kinase": "build/kinase_rts_60min_gradient.csv",
+    "proteome": "build/pepdb_rts_60min_gradient.feather",
+    "liver": "build/liver_rts_60min_gradient.feather",
+    "kinase": "build/kinase_rts_60min_gradient.feather",
 }
 
 
@@ -48,17 +48,20 @@ def main():
                     rule = f"${{PYTHON}} src/needler.py --shuffle --sortgroups --verbose --timeout={args.solve_seconds} --targets={target} --rtwidth={rt} --dst={filename} {tissue_db}"
                     make_targets[tissue_name].append((filename, rule))
 
+    # the top level dependency list for "ease" of human review
+    # unreadable, but technically there
+    header_lines = [
+        f"{tissue_name} : {' '.join(targ for targ, _ in sub_targets)}\n\n"
+        for tissue_name, sub_targets in make_targets.items()
+    ]
+    # followed by the actual rules
+    rule_lines = [
+        f"{target} :\n\t{rule}\n\n"
+        for dependencies in make_targets.values()
+        for target, rule in dependencies
+    ]
     with open(args.dst, "w") as handle:
-        # write the top level dependency list for "ease" of human review
-        # unreadable, but technically there
-        for tissue_name, sub_targets in make_targets.items():
-            sub_target_str = " ".join((targ for targ, _ in sub_targets))
-            handle.write(f"{tissue_name} : {sub_target_str}\n\n")
-        # now write out the actual rules
-        for dependencies in make_targets.values():
-            for target, rule in dependencies:
-                handle.write(f"{target} :\n")
-                handle.write(f"\t{rule}\n\n")
+        handle.write("".join(header_lines + rule_lines))
 
 
 if __name__ == "__main__":
@@ -1,11 +1,13 @@
 import argparse
-from collections import defaultdict
 import os
 
+import numpy as np
 import pandas as pd
 from pyteomics import parser as digest
 from pyteomics import mass
 
+from io_util import read_table, write_table
+
 
 def composition_to_string(x):
     pieces = []
@@ -14,6 +16,40 @@ def composition_to_string(x):
     return "".join(pieces)
 
 
+def peptide_compositions(peptides, aa_comp):
+    # atom counts for every peptide in one vectorized pass
+    # each ascii residue code indexes a row of atom counts, the modification marker "c"
+    # holds the difference between "cC" and "C" so that "cC" sums to the modified cysteine
+    elements = sorted({atom for comp in aa_comp.values() for atom in comp})
+    residue_table = np.zeros((128, len(elements)), dtype=np.int32)
+    known = np.zeros(128, dtype=bool)
+    for aa, comp in aa_comp.items():
+        if len(aa) == 1:
+            residue_table[ord(aa)] = [comp.get(atom, 0) for atom in elements]
+            known[ord(aa)] = True
+    known[ord("c")] = True
+    residue_table[ord("c")] = [
+        aa_comp["cC"].get(atom, 0) - aa_comp["C"].get(atom, 0) for atom in elements
+    ]
+    # peptide termini, H- and -OH, add one water
+    terminal = aa_comp["H-"] + aa_comp["-OH"]
+    terminal_counts = np.array([terminal.get(atom, 0) for atom in elements], dtype=np.int32)
+
+    counts = np.tile(terminal_counts, (len(peptides), 1))
+    if len(peptides) > 0:
+        codes = np.frombuffer("".join(peptides).encode("ascii"), dtype=np.uint8)
+        # an unknown residue would otherwise silently contribute no atoms
+        if not known[codes].all():
+            unknown = sorted({chr(code) for code in np.unique(codes[~known[codes]])})
+            raise ValueError(f"No composition for residues: {', '.join(unknown)}")
+        lengths = np.fromiter((len(p) for p in peptides), dtype=np.intp, count=len(peptides))
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        # one column at a time keeps the gathered residue rows small
+        for j in range(len(elements)):
+            counts[:, j] += np.add.reduceat(residue_table[codes, j], offsets)
+    return elements, counts
+
+
 def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--proteins", dest="proteins")
@@ -32,25 +68,29 @@ def get_args():
 def main():
     args = get_args()
 
-    proteins = pd.read_csv(args.proteins)
+    proteins = read_table(args.proteins)
     dst_filename = os.path.normpath(args.peptides)
 
     # create dictionary keyed on peptide sequence with list of protein accessions
-    peptides = defaultdict(list)
-    for _, row in proteins.iterrows():
-        accession = row["accession"]
-        sequence = row["sequence"]
+    # iterate the raw column arrays rather than iterrows to avoid per-row Series boxing
+    accessions = proteins["accession"].to_numpy()
+    sequences = proteins["sequence"].to_numpy()
+    trypsin = digest.expasy_rules["trypsin"]
+    min_length = args.min_length
+    max_length = args.max_length
+    peptides = {}
+    for accession, sequence in zip(accessions, sequences):
         peps = digest.cleave(
             sequence,
-            digest.expasy_rules["trypsin"],
+            trypsin,
             missed_cleavages=0,
-            min_length=args.min_length,
+            min_length=min_length,
         )
         for pep in peps:
             # some proteins have 'X' and 'U' (selenocystine) amino acids listed
             # have no mechanism to handle those currently
-            if len(pep) <= args.max_length and "X" not in pep and "U" not in pep:
-                peptides[pep].append(accession)
+            if len(pep) <= max_length and "X" not in pep and "U" not in pep:
+                peptides.setdefault(pep, []).append(accession)
     # identify the peptides represented by single protein accession
     distinct = []
     for peptide, accessions in peptides.items():
@@ -58,23 +98,36 @@ def main():
             distinct.append({"accession": accessions[0], "peptide_sequence": peptide})
     distinct_peps = pd.DataFrame(distinct)
     proteins.drop(["sequence", "taxonomy_id"], axis=1, inplace=True)
-    df = pd.merge(proteins, distinct_peps, how="inner", on="accession")
+    # merge on shared integer category codes rather than hashing the accession strings
+    accession_key = proteins.accession.unique()
+    proteins["accession"] = pd.Categorical(proteins.accession, categories=accession_key)
+    distinct_peps["accession"] = pd.Categorical(
+        distinct_peps.accession, categories=accession_key
+    )
+    df = pd.merge(proteins, distinct_peps, how="inner", on="accession", sort=False)
+    df["accession"] = df.accession.astype(object)
     # all peptides are carbamidomethylated
     df["peptide"] = df.peptide_sequence.str.replace("C", "cC")
     # build the modded cys definition
     aa_comp = dict(mass.std_aa_comp)
     aa_comp["cC"] = aa_comp["C"] + mass.Composition("C2H3NO")
-    compositions = df.peptide.apply(
-        lambda x: mass.Composition(sequence=x, aa_comp=aa_comp)
-    )
-    df["formula"] = compositions.apply(composition_to_string)
-    df["mw"] = compositions.apply(
-        lambda x: mass.calculate_mass(x, average=False, charge=0)
-    )
+    # the same peptide repeats across rows, only compute a composition once per sequence
+    unique_peptides = df["peptide"].unique().tolist()
+    elements, counts = peptide_compositions(unique_peptides, aa_comp)
+    # monoisotopic mass of each element
+    element_masses = np.array([mass.nist_mass[atom][0][0] for atom in elements])
+    masses = dict(zip(unique_peptides, (counts @ element_masses).tolist()))
+    formulas = {}
+    for peptide, row in zip(unique_peptides, counts.tolist()):
+        formulas[peptide] = composition_to_string(
+            {atom: n for atom, n in zip(elements, row) if n}
+        )
+    df["formula"] = df["peptide"].map(formulas)
+    df["mw"] = df["peptide"].map(masses).astype("float64")
 
     df.sort_values(["gene", "accession", "isoform", "peptide_sequence"], inplace=True)
     if args.unfiltered_filename is not None:
-        df.to_csv(args.unfiltered_filename, index=False, encoding="utf8")
+        write_table(df, args.unfiltered_filename)
 
     # drop Met containing peptides, unreliable targets not worth considering
     df = df.loc[~df.peptide_sequence.str.contains("M")]
@@ -82,8 +135,8 @@ def main():
     acc_counts = df.groupby(["accession"]).peptide_sequence.nunique()
     accessions_gte_peps = list(acc_counts[acc_counts >= args.min_peptides].index)
 
-    df[df.accession.isin(accessions_gte_peps)].to_csv(
-        dst_filename, index=False, encoding="utf8", float_format="%.4f"
+    write_table(
+        df[df.accession.isin(accessions_gte_peps)], dst_filename, float_format="%.4f"
     )
 
 
@@ -1,11 +1,11 @@
-# Extract .csv representation of proteins from .fasta
+# Extract table representation of proteins from .fasta
 
 import argparse
 import os
 
-import numpy as np
 import pandas as pd
-from pyteomics import fasta
+
+from io_util import write_table
 
 SPECIES = {
     "OX=9606",  # human
@@ -16,12 +16,46 @@ SPECIES = {
 }
 
 
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# eg: sp|P31946-2|1433B_HUMAN Isoform Short of 14-3-3 protein beta/alpha OS=Homo sapiens OX=9606 GN=YWHAB
+HEADER_PATTERN = (
+    r"^[^|]*\|(?P<accession>[^|]+?(?:-(?P<isoform>\d+))?)\|(?P<name>\S+)\s+"
+    r"(?P<description>.*?OX=(?P<taxonomy_id>\S+)(?:.*?GN=(?P<gene>\S+))?.*)$"
+)
+
+
+def parse_record(record, species):
+    # only slice the header, the sequence is not materialized for unwanted species
+    header_end = record.find(b"\n")
+    header = record if header_end < 0 else record[:header_end]
+    if not any(species_name in header for species_name in species):
+        return None
+    seq = b"" if header_end < 0 else record[header_end + 1 :]
+    header = header.lstrip(b">").rstrip(b"\r")
+    seq = seq.replace(b"\n", b"").replace(b"\r", b"").rstrip(b"*")
+    return (header.decode("utf-8"), seq.decode("utf-8"))
+
+
 def gen_entries(filename):
-    with fasta.read(filename) as handle:
-        for header, seq in handle:
-            for species_name in SPECIES:
-                if species_name in header:
-                    yield (header, seq)
+    species = [species_name.encode("ascii") for species_name in SPECIES]
+    with open(filename, "rb") as handle:
+        remainder = b""
+        while True:
+            chunk = handle.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            records = (remainder + chunk).split(b"\n>")
+            # last record may continue into the next chunk
+            remainder = records.pop()
+            for record in records:
+                entry = parse_record(record, species)
+                if entry is not None:
+                    yield entry
+        if remainder.strip():
+            entry = parse_record(remainder, species)
+            if entry is not None:
+                yield entry
 
 
 def main():
@@ -38,20 +72,19 @@ def main():
 
     proteins = gen_entries(fasta_filename)
     df = pd.DataFrame(list(proteins), columns=("header", "sequence"))
-    tokens = df.header.str.split("|", 2)
-    df["accession"] = tokens.str[1].str.replace("-1$", "", regex=False)
+    # pull all of the header fields in a single pass
+    fields = df.header.str.extract(HEADER_PATTERN)
+    df["accession"] = fields["accession"]
     # if isoform is not specified, is implicit '1' - make it explicit
-    df["isoform"] = tokens.str[1].str.split("-").str[1].replace(np.nan, 1).astype(int)
-    df["name"] = tokens.str[2].str.split(" ", 1).str[0]
-    df["description"] = tokens.str[2].str.split(" ", 1).str[-1]
-    df["taxonomy_id"] = (
-        df["description"].str.extract("OX=([\S]+)")[0].str.strip().astype(int)
-    )
-    df["gene"] = df["description"].str.extract("GN=([\S]+)")[0].str.strip()
+    df["isoform"] = fields["isoform"].fillna("1").astype("int32")
+    df["name"] = fields["name"]
+    df["description"] = fields["description"]
+    df["taxonomy_id"] = fields["taxonomy_id"].astype(int)
+    df["gene"] = fields["gene"]
     df.drop(["header"], axis=1, inplace=True)
     df.sort_values(["taxonomy_id", "gene", "name", "isoform"], inplace=True)
     col_order = ["accession", "isoform", "name", "gene", "taxonomy_id", "sequence"]
-    df[col_order].to_csv(dst_filename, index=False, encoding="utf8")
+    write_table(df[col_order], dst_filename)
 
 
 if __name__ == "__main__":
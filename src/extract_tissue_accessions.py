@@ -2,55 +2,138 @@
 # Use the Uniprot webservice to convert from Ensembl protein ID into uniprot accession
 
 import argparse
-import urllib.parse
-import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import json
+import sqlite3
+import time
 
 import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
 import tqdm
 
-URL = "https://www.uniprot.org/uploadlists/"
+# Uniprot ID mapping REST API (2022+), the legacy /uploadlists/ endpoint is retired
+URL = "https://rest.uniprot.org/idmapping"
+BLOCK_SIZE = 50
+MAX_WORKERS = 8
+POLL_SECONDS = 2
+MAX_POLLS = 300  # give up on a job after ~10 minutes
+
+
+def get_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=MAX_WORKERS, max_retries=3)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch(session, block):
+    # submit the mapping job, poll until it is finished, then pull the results
+    response = session.post(
+        f"{URL}/run",
+        data={"from": "Ensembl_Protein", "to": "UniProtKB", "ids": ",".join(block)},
+    )
+    response.raise_for_status()
+    job_id = response.json()["jobId"]
+
+    for _ in range(MAX_POLLS):
+        response = session.get(f"{URL}/status/{job_id}", allow_redirects=False)
+        # finished jobs redirect to their results
+        if response.is_redirect:
+            break
+        response.raise_for_status()
+        status = response.json()
+        if status.get("jobStatus") in ("NEW", "RUNNING"):
+            time.sleep(POLL_SECONDS)
+            continue
+        if "jobStatus" in status and status["jobStatus"] != "FINISHED":
+            raise RuntimeError(f"Uniprot ID mapping job {job_id} failed: {status}")
+        break
+    else:
+        raise RuntimeError(
+            f"Uniprot ID mapping job {job_id} not finished after {MAX_POLLS * POLL_SECONDS} seconds"
+        )
+
+    response = session.get(f"{URL}/details/{job_id}")
+    response.raise_for_status()
+    results_url = response.json()["redirectURL"].replace("/results/", "/results/stream/")
+    response = session.get(results_url, params={"format": "json", "fields": "accession"})
+    response.raise_for_status()
+
+    pairs = []
+    for result in response.json()["results"]:
+        to = result["to"]
+        accession = to["primaryAccession"] if isinstance(to, dict) else to
+        pairs.append((result["from"].strip(), accession.strip()))
+    return pairs
+
+
+def open_cache(filename):
+    conn = sqlite3.connect(filename)
+    conn.execute("CREATE TABLE IF NOT EXISTS idmapping (block TEXT PRIMARY KEY, pairs TEXT)")
+    return conn
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--tissuedb", dest="tissuedb")
+    parser.add_argument(
+        "--cache",
+        dest="cache",
+        default=None,
+        help="sqlite file memoizing the Uniprot responses between runs",
+    )
     parser.add_argument("dst")
 
     args = parser.parse_args()
     db = pd.read_excel(args.tissuedb, sheet_name="A. Protein copies")
 
     liver_proteins = db[db["Liver"] > 0]
-    # pull the Ensembl Protein ID
-    prot_ids = list(set(liver_proteins["Protein ID"]))
+    # pull the Ensembl Protein ID, sorted so blocks (and cache keys) are reproducible
+    prot_ids = sorted(set(liver_proteins["Protein ID"]))
 
     # use the uniprot webservice to convert Ensembl <-> Accession
     # query subset at a time
-    BLOCK_SIZE = 50
-    rows = []
-    for pivot in tqdm.tqdm(range(0, len(prot_ids), BLOCK_SIZE)):
-        query_ids = " ".join(prot_ids[pivot : pivot + BLOCK_SIZE])
-        params = {
-            "from": "ENSEMBL_PRO_ID",
-            "to": "ACC",
-            "format": "tab",
-            "query": query_ids,
-        }
-        data = urllib.parse.urlencode(params)
-        data = data.encode("utf-8")
-        request = urllib.request.Request(URL, data)
-        with urllib.request.urlopen(request) as handle:
-            response = handle.read()
-            for i, line in enumerate(response.decode("utf-8").splitlines()):
-                if i != 0:
-                    ensembl, accession = line.split("\t")
-                    rows.append(
-                        {
-                            "ensembl_protein_id": ensembl.strip(),
-                            "accession": accession.strip(),
-                        }
+    blocks = [
+        prot_ids[pivot : pivot + BLOCK_SIZE]
+        for pivot in range(0, len(prot_ids), BLOCK_SIZE)
+    ]
+    conn = open_cache(args.cache) if args.cache is not None else None
+    block_pairs = {}
+    if conn is not None:
+        for block in blocks:
+            key = " ".join(block)
+            row = conn.execute(
+                "SELECT pairs FROM idmapping WHERE block = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                block_pairs[key] = json.loads(row[0])
+    missing = [block for block in blocks if " ".join(block) not in block_pairs]
+
+    session = get_session()
+    try:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            results = executor.map(lambda block: fetch(session, block), missing)
+            # cache each block as it arrives so a later failure keeps the earlier responses
+            for block, pairs in tqdm.tqdm(zip(missing, results), total=len(missing)):
+                key = " ".join(block)
+                block_pairs[key] = pairs
+                if conn is not None:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO idmapping (block, pairs) VALUES (?, ?)",
+                        (key, json.dumps(pairs)),
                     )
+                    conn.commit()
+    finally:
+        if conn is not None:
+            conn.close()
+
+    rows = []
+    for pairs in block_pairs.values():
+        for ensembl, accession in pairs:
+            rows.append({"ensembl_protein_id": ensembl, "accession": accession})
 
-    df = pd.DataFrame(rows)
+    df = pd.DataFrame(rows, columns=["ensembl_protein_id", "accession"])
     df.drop_duplicates(inplace=True)
     df.to_csv(args.dst, index=False, encoding="utf8")
 
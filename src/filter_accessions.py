@@ -1,6 +1,6 @@
 import argparse
 
-import pandas as pd
+from io_util import read_table, write_table
 
 
 def main():
@@ -10,12 +10,13 @@ def main():
     parser.add_argument("dstdb")
 
     args = parser.parse_args()
-    db = pd.read_csv(args.pepdb)
-    filter_src = pd.read_csv(args.filter_src)
+    db = read_table(args.pepdb)
+    filter_src = read_table(args.filter_src)
 
-    accessions = set(filter_src.accession)
+    # isin builds its own hash table, no need to go through a python set
+    accessions = filter_src.accession.unique()
     res = db[db.accession.isin(accessions)]
-    res.to_csv(args.dstdb, index=False, encoding="utf8", float_format="%.4f")
+    write_table(res, args.dstdb, float_format="%.4f")
 
 
 if __name__ == "__main__":
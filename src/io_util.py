@@ -0,0 +1,43 @@
+# Shared table reading/writing for the pipeline stages.
+# Intermediate artifacts are stored as Feather (Arrow IPC) or Parquet which avoids
+# re-parsing text on every stage, csv is still supported for user-facing files.
+
+import os
+
+import pandas as pd
+from pyarrow import csv as pacsv
+
+FEATHER_EXTENSIONS = {".feather", ".arrow"}
+PARQUET_EXTENSIONS = {".parquet", ".pq"}
+
+
+def _extension(filename):
+    return os.path.splitext(filename)[1].lower()
+
+
+def read_table(filename, columns=None):
+    ext = _extension(filename)
+    if ext in FEATHER_EXTENSIONS:
+        return pd.read_feather(filename, columns=columns)
+    if ext in PARQUET_EXTENSIONS:
+        return pd.read_parquet(filename, columns=columns)
+    # arrow parses the columns multithreaded in C++, empty strings are read as missing
+    # values to match the default pandas parser
+    convert_options = pacsv.ConvertOptions(
+        strings_can_be_null=True, include_columns=columns or []
+    )
+    return pacsv.read_csv(filename, convert_options=convert_options).to_pandas()
+
+
+def write_table(df, filename, **csv_kwargs):
+    # csv_kwargs (eg float_format) only apply to csv output, binary formats keep full precision
+    ext = _extension(filename)
+    if ext in FEATHER_EXTENSIONS:
+        # feather does not store a non-default index
+        df.reset_index(drop=True).to_feather(filename)
+    elif ext in PARQUET_EXTENSIONS:
+        df.to_parquet(
+            filename, index=False, compression="zstd", compression_level=3
+        )
+    else:
+        df.to_csv(filename, index=False, encoding="utf8", **csv_kwargs)
@@ -12,13 +12,15 @@ import argparse
 import datetime
 import logging
 import os
-import random
 import shutil
-import uuid
 
-import pandas as pd
+import numpy as np
+import pyarrow as pa
+from pyarrow import csv as pacsv
 import z3
 
+from io_util import read_table
+
 logger = logging.getLogger()
 
 
@@ -81,7 +83,17 @@ class Needler:
         self.sort_groups = sort_groups
 
     def load(self):
-        self.df = pd.read_csv(self.db_src)
+        # only materialize the fields used by the model and the saved results
+        columns = [
+            "accession",
+            "isoform",
+            "name",
+            "gene",
+            "peptide_sequence",
+            "peptide",
+            "prosit_predicted_rt_seconds",
+        ]
+        self.df = read_table(self.db_src, columns=columns)
         initial_rows = self.df.shape[0]
         self.df["protein_id"] = self.df.accession
         self.df["peptide_id"] = self.df.peptide_sequence
@@ -90,13 +102,13 @@ class Needler:
         logger.debug(f"Input file unique peptides: {self.df.peptide_id.nunique()}")
 
         self.df["protein_peps"] = self.df.groupby(["protein_id"]).peptide_id.transform(
-            lambda x: x.nunique()
+            "nunique"
         )
         # are there any proteins with fewer than minimum peptides_per_protein? remove them
-        bidx = self.df.protein_peps < self.peps_per_prot
-        if bidx.sum() > 0:
-            acc_count_removed = self.df[bidx].protein_id.nunique()
-            self.df = self.df.loc[self.df.protein_peps >= args.peps_per_prot]
+        keep = self.df.protein_peps >= self.peps_per_prot
+        if not keep.all():
+            acc_count_removed = self.df.protein_id[~keep].nunique()
+            self.df = self.df[keep].reset_index(drop=True)
             logger.info(
                 f"Dropping proteins with insufficient available peptides, proteins removed: {acc_count_removed}"
             )
@@ -105,14 +117,17 @@ class Needler:
         self.peptide_order = sorted(set(self.df.peptide_id))
         if self.shuffle:
             # z3 is ~deterministic, some ordering is dependent upon
-            # variable name, contents, and/or insert order. Using uuids to help randomize
-            accession_guid = self.df.groupby(["protein_id"]).apply(
-                lambda x: "{}".format(uuid.uuid4())
-            )
-            self.df["protein_id"] = self.df.protein_id.replace(accession_guid)
-            self.df["peptide_id"] = self.df["peptide_id"].apply(
-                lambda x: f"{uuid.uuid4()}"
-            )
+            # variable name, contents, and/or insert order. Using random 64 bit ids to help randomize
+            rng = np.random.default_rng()
+            protein_ids = self.df.protein_id.unique()
+            protein_rand = rng.integers(0, 2**63 - 1, size=len(protein_ids))
+            accession_guid = {
+                pid: "a" + format(v, "x")
+                for pid, v in zip(protein_ids, protein_rand.tolist())
+            }
+            self.df["protein_id"] = self.df.protein_id.map(accession_guid)
+            peptide_rand = rng.integers(0, 2**63 - 1, size=self.df.shape[0])
+            self.df["peptide_id"] = ["p" + format(v, "x") for v in peptide_rand.tolist()]
             logger.debug("Shuffling the protein and peptide ids")
             # re-order dataframe rows
             self.df = self.df.sample(frac=1).reset_index(drop=True)
@@ -131,27 +146,32 @@ class Needler:
             )
             self.protein_order = list(dict.fromkeys(self.df.protein_id))
 
-        self.df["rt_start"] = (
-            self.df.prosit_predicted_rt_seconds - self.rt_width
-        ).astype(int)
-        self.df["rt_stop"] = (
-            self.df.prosit_predicted_rt_seconds + self.rt_width
-        ).astype(int)
-        bidx = self.df.rt_start < 0
-        if bidx.sum() > 0:
+        rt_arr = self.df.prosit_predicted_rt_seconds.to_numpy(dtype=np.int32)
+        rt_start = rt_arr - self.rt_width
+        negative_starts = (rt_start < 0).sum()
+        if negative_starts > 0:
             logger.info(
-                f"Adjusting negative peptide rt_start values to 0 for peptides: {bidx.sum()}"
+                f"Adjusting negative peptide rt_start values to 0 for peptides: {negative_starts}"
+            )
+        self.df["rt_start"] = np.clip(rt_start, 0, None)
+        self.df["rt_stop"] = rt_arr + self.rt_width
+        negative_stops = (self.df.rt_stop < 0).sum()
+        if negative_stops > 0:
+            logger.info(
+                f"Peptides eluting before 0 are excluded from the gradient constraints: {negative_stops}"
             )
 
         if initial_rows != self.df.shape[0]:
             logger.debug(
-                "Filtering occured, remaining unique proteins: {self.df.protein_id.nunique()}"
+                f"Filtering occured, remaining unique proteins: {self.df.protein_id.nunique()}"
             )
             logger.debug(
-                "Filtering occured, remaining peptides: {self.df.peptide_id.nunique()}"
+                f"Filtering occured, remaining peptides: {self.df.peptide_id.nunique()}"
             )
 
     def build_model(self):
+        shuffle = self.shuffle
+        rng = np.random.default_rng()
         self.solver = z3.Solver()
         # enabling these two configurations allows speedups on using pseudo-booleans
         self.solver.set("sat.pb.solver", "solver")
@@ -166,6 +186,12 @@ class Needler:
         for pep_id in self.peptide_order:
             # implicitly benefiting from those ordered dictionaries
             self.peptides[pep_id] = z3.Bool(pep_id)
+        # integer peptide index aligned with an object array of the z3 Bools
+        # allows selecting a batch of Bools with a single numpy index
+        pep_to_idx = {pep_id: i for i, pep_id in enumerate(self.peptide_order)}
+        pep_bool_arr = np.empty(len(self.peptide_order), dtype=object)
+        pep_bool_arr[:] = [self.peptides[pep_id] for pep_id in self.peptide_order]
+        self.df["pep_idx"] = self.df.peptide_id.map(pep_to_idx).to_numpy()
 
         # give z3 a hint that at most XXX peptides should be true in a given solution
         # For example: gradient is 90 seconds long, 3 peptides/cycle, peptide elutes over 30 seconds: can only target 9 peps
@@ -187,12 +213,18 @@ class Needler:
 
         logger.info("Assigning the protein-peptide relationship")
         self.proteins_targeted = []
+        # single pass over the dataframe rather than a full scan per protein
+        prot2peps = (
+            self.df.groupby("protein_id")["peptide_id"]
+            .apply(lambda s: list(dict.fromkeys(s)))
+            .to_dict()
+        )
         for prot_id in self.protein_order:
-            protein_peptide_ids = set(self.df[self.df.protein_id == prot_id].peptide_id)
+            protein_peptide_ids = prot2peps[prot_id]
             # PseudoBoolean tricks require returning a tuple of the (Z3.Bool, int) representing value
             pseudo_bools = [(self.peptides[pid], 1) for pid in protein_peptide_ids]
-            if args.shuffle:
-                random.shuffle(pseudo_bools)
+            if shuffle:
+                rng.shuffle(pseudo_bools)
             # collection of peptides associated with this protein must be either
             # - 0 (none selected) or equal to the target value
             self.solver.add(
@@ -211,26 +243,52 @@ class Needler:
         logger.info(f"Setting intial protein target >\t{protein_target}")
         self.solver.add(z3.Sum(self.proteins_targeted) > protein_target)
 
-        # Iterate over each cycle of the gradient (eg seconds)
-        # Identify all peptides eluting at this point
+        # Sweep over the gradient (eg seconds), peptides occupy the inclusive interval
+        # [rt_start, rt_stop] so are added to the active set at rt_start and removed at rt_stop + 1.
         # Sum any targeted peptides and ensure that the number of peptides is
-        # less than the maximum allowed targets per cycle
+        # less than the maximum allowed targets per cycle.
+        # Only time points where peptides were added need a constraint: a set reached purely by
+        # removals is a subset of an already constrained set. Sets with no more than the allowed
+        # targets can never be violated, and identical sets only need to be constrained once.
         logger.info("Assigning gradient constraints")
-        rt_minimum = max(self.df.rt_start.min(), 0)
-        rt_maximum = self.df.rt_stop.max()
-        time_steps = list(range(rt_minimum, rt_maximum + 1))
-        logger.debug(f"Time steps to model: {len(time_steps)}")
-        if self.shuffle:
-            random.shuffle(time_steps)
-        for i in time_steps:
-            # note this is inclusive on both ends of the time range
-            bidx = (self.df.rt_start <= i) & (self.df.rt_stop >= i)
-            if bidx.sum() > 0:
-                pep_ids = set(self.df[bidx].peptide_id)
-                time_slot_peptides = [self.peptides[pid] for pid in pep_ids]
-                if args.shuffle:
-                    random.shuffle(time_slot_peptides)
-                self.solver.add(z3.AtMost(*time_slot_peptides, self.targets_per_cycle))
+        # a window ending before 0 is empty once rt_start is clipped, those peptides never elute
+        # within the gradient and would otherwise be added without ever being removed
+        eluting = self.df.loc[self.df.rt_start <= self.df.rt_stop, ["rt_start", "rt_stop", "pep_idx"]]
+        starts = eluting[["rt_start", "pep_idx"]].sort_values("rt_start", kind="mergesort")
+        stops = eluting[["rt_stop", "pep_idx"]].sort_values("rt_stop", kind="mergesort")
+        start_times = starts.rt_start.to_numpy()
+        start_ids = starts.pep_idx.to_numpy().tolist()
+        stop_times = stops.rt_stop.to_numpy() + 1
+        stop_ids = stops.pep_idx.to_numpy().tolist()
+        n_events = len(start_times)
+
+        active = set()
+        seen = set()
+        time_windows = []
+        start_idx = 0
+        stop_idx = 0
+        while start_idx < n_events:
+            t = start_times[start_idx]
+            while stop_idx < n_events and stop_times[stop_idx] <= t:
+                active.discard(stop_ids[stop_idx])
+                stop_idx += 1
+            while start_idx < n_events and start_times[start_idx] == t:
+                active.add(start_ids[start_idx])
+                start_idx += 1
+            if len(active) > self.targets_per_cycle:
+                window = frozenset(active)
+                if window not in seen:
+                    seen.add(window)
+                    time_windows.append(window)
+        logger.debug(f"Time windows to model: {len(time_windows)}")
+        if shuffle:
+            rng.shuffle(time_windows)
+        for window in time_windows:
+            idxs = np.fromiter(window, dtype=np.intp, count=len(window))
+            time_slot_peptides = [(pep_bool, 1) for pep_bool in pep_bool_arr[idxs].tolist()]
+            if shuffle:
+                rng.shuffle(time_slot_peptides)
+            self.solver.add(z3.PbLe(time_slot_peptides, self.targets_per_cycle))
 
     def save(self):
         # write to temp name in case there is crash
@@ -251,7 +309,9 @@ class Needler:
             "rt_start",
             "rt_stop",
         ]
-        self.df[bidx][columns].to_csv(temp_name, index=False, encoding="utf8")
+        # arrow writes the csv column-wise in C++, save is called for each improved model
+        table = pa.Table.from_pandas(self.df.loc[bidx, columns], preserve_index=False)
+        pacsv.write_csv(table, temp_name)
         shutil.move(temp_name, self.dst)
 
     def optimize(self):
@@ -4,6 +4,8 @@ import numpy as np
 import pandas as pd
 from scipy import stats
 
+from io_util import read_table, write_table
+
 
 def main():
     parser = argparse.ArgumentParser()
@@ -13,9 +15,9 @@ def main():
     parser.add_argument("dstdb")
 
     args = parser.parse_args()
-    peptides = pd.read_csv(args.peptides)
-    procal = pd.read_csv(args.procal)
-    prosit = pd.read_csv(args.prosit)  # prost predicted irts
+    peptides = read_table(args.peptides)
+    procal = read_table(args.procal)
+    prosit = read_table(args.prosit)  # prost predicted irts
 
     # add irts to the emperical procal rts
     procal = pd.merge(procal, prosit, how="left", on="peptide_sequence")
@@ -30,11 +32,25 @@ def main():
     )
 
     # align the predicted iRT values for supplied peptides
-    res = pd.merge(peptides, prosit, how="left", on="peptide_sequence")
+    # merge on shared integer category codes rather than hashing the peptide strings
+    sequence_key = pd.api.types.union_categoricals(
+        [
+            peptides.peptide_sequence.astype("category"),
+            prosit.peptide_sequence.astype("category"),
+        ]
+    ).categories
+    peptides["peptide_sequence"] = pd.Categorical(
+        peptides.peptide_sequence, categories=sequence_key
+    )
+    prosit["peptide_sequence"] = pd.Categorical(
+        prosit.peptide_sequence, categories=sequence_key
+    )
+    res = pd.merge(peptides, prosit, how="left", on="peptide_sequence", sort=False)
+    res["peptide_sequence"] = res.peptide_sequence.astype(object)
     # convert the iRT<->RT
     rt_minutes = res.prosit_predicted_irt * slope + intercept
     res["prosit_predicted_rt_seconds"] = np.round(rt_minutes * 60.0, 0).astype(int)
-    res.to_csv(args.dstdb, index=False, encoding="utf8", float_format="%.4f")
+    write_table(res, args.dstdb, float_format="%.4f")
 
 
 if __name__ == "__main__":